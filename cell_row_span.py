@@ -96,13 +96,7 @@ a cell containing only '~~' as an empty cell. (I chose '~~' because I can't thin
 of a reason anyone would use that in a cell.) If you want to use something
 different, change '~~' to another value in the following line in the code:
 
-    RE_empty_cell = re.compile(r'\s*(~~)?\s*$')
-
-Keep in mind that many characters have special meaning in regular expressions.
-If you use any of the following characters in the expression, preceed them with
-a backslash ("\\") to avoid problems:
-
-    . + * | ? $ ( ) [ ] { }
+    EMPTY_CELL = '~~'
 
 Usage: See Extensions for general extension usage. Use 'cell_row_span' as the
 name of the extension. You must include the 'tables' extension *before* this
@@ -126,6 +120,25 @@ from markdown.treeprocessors import Treeprocessor
 from markdown.util import etree
 import re
 
+EMPTY_CELL = '~~'   # Cell content treated as empty, in addition to whitespace
+_EMPTY_BARS = '|%s|' % EMPTY_CELL
+
+# Python 2 has no re.ASCII; its str patterns are ASCII-only already
+RE_row_span_marker = re.compile(r'^_[_^= ]*_$', getattr(re, 'ASCII', 0))
+
+
+def _is_empty_cell(text):
+    """ Return True if a cell's text is blank or contains only EMPTY_CELL """
+    if not text:
+        return True
+    text = text.strip()
+    return not text or text == EMPTY_CELL
+
+
+def _has_adjacent_bars(text):
+    """ Return True if text contains '||' or '|' EMPTY_CELL '|' (a column span) """
+    return '||' in text or _EMPTY_BARS in text
+
 
 class CellRowSpanExtension(Extension):
     """ Table Cell and Row Span extension """
@@ -158,115 +171,163 @@ class CellRowSpanBlockProcessor(BlockProcessor):
         return self.table_blockprocessor.test(parent, block)
 
     def run(self, parent, blocks):
-        """ Add the table block's source to our list """
-        self.table_blocks.append(blocks[0])
+        """ Add the table block's source rows to our list """
+        block = blocks[0]
+        # Without adjacent bars or underscores there is nothing to span, so
+        # save None to keep our list in step with the tables in the document
+        if '_' not in block and not _has_adjacent_bars(block):
+            self.table_blocks.append(None)
+        else:
+            self.table_blocks.append(block.split('\n'))
         return False    # Tell the BlockProcessor we didn't process the block
 
 
 class CellRowSpanTreeProcessor(Treeprocessor):
     """ Add cell and row spans to table as needed """
 
-    RE_adjacent_bars = re.compile(r'\|(~~)?\|')
-    RE_remove_lead_pipe = re.compile(r'^ *\|')  # ... Colonel Mustard in the Library? ;)
-    RE_row_span_marker = re.compile(r'^_[_^= ]*_$')
-    RE_valign_top = re.compile(r'\^')
-    RE_valign_bottom = re.compile(r'=')
-    RE_empty_cell = re.compile(r'\s*(~~)?\s*$')
-
     def __init__(self, extension_obj):
         self.table_blocks = extension_obj.table_blocks
         super(CellRowSpanTreeProcessor, self).__init__()
 
     def _update_colspan_attrib(self, text, t_index, tr_index, tr, td_remove):
         """ Update 'colspan' attributes in 'td' entries """
-        text = self.RE_remove_lead_pipe.sub('', text)   # Remove leading '|' from text
+        stripped = text.lstrip(' ')     # Remove leading '|' from text
+        if stripped.startswith('|'):
+            text = stripped[1:]
         td_index = 0
         td_last_active_index = 0
+        td = None           # Cell that the current run of empty cells merges into
+        run_start = 0       # Index of the first empty cell in the current run
+        run_len = 0         # Number of empty cells in the current run
 
         for c in text.split('|'):
-            if len(c) == 0 or c == '~~':
-                try:
-                    td = tr[td_last_active_index]           #  Update 'colspan' on previous cell
-                except IndexError:
-                    row_content = ''
-                    for i in range(len(tr)):
-                        x = tr[i].text
-                        row_content += "  Cell %i: %s\n" % (i+1, x if x else 'Empty')
-                    raise IndexError(
-                        'Cannot merge cell beyond end of row '
-                        "(one too many '|' characters in row?)\n"
-                        'Check row %i of table %i in your document. Row contents:\n%s' % (
-                            tr_index+1, t_index, row_content
+            if len(c) == 0 or c == EMPTY_CELL:
+                if td is None:
+                    try:
+                        td = tr[td_last_active_index]       #  Update 'colspan' on previous cell
+                    except IndexError:
+                        row_content = ''
+                        for i in range(len(tr)):
+                            x = tr[i].text
+                            row_content += "  Cell %i: %s\n" % (i+1, x if x else 'Empty')
+                        raise IndexError(
+                            'Cannot merge cell beyond end of row '
+                            "(one too many '|' characters in row?)\n"
+                            'Check row %i of table %i in your document. Row contents:\n%s' % (
+                                tr_index+1, t_index, row_content
+                            )
                         )
-                    )
+                    run_start = td_index
                 if td_index < len(tr):
-                    span = 1
-                    if 'colspan' in td.keys():
-                        span = int(td.get('colspan'))
-                    td.set('colspan', str(span+1))
-                    td_remove.append( (tr, tr[td_index]) )
+                    run_len += 1
             else:
+                self._merge_cells(tr, td, run_start, run_len, td_remove)
+                td = None
+                run_len = 0
                 td_last_active_index = td_index
             td_index += 1
+        self._merge_cells(tr, td, run_start, run_len, td_remove)
 
-    def _update_rowspan_attrib(self, tbody, tr_index, td_index, td_remove):
+    def _merge_cells(self, tr, td, run_start, run_len, td_remove):
+        """ Merge a run of empty cells into 'td' with a single 'colspan' update """
+        if run_len:
+            attrib = td.attrib
+            attrib['colspan'] = str(int(attrib.get('colspan', '1')) + run_len)
+            td_remove.extend((tr, tr[i]) for i in range(run_start, run_start+run_len))
+
+    def _update_rowspan_attrib(self, tr_list, column, t_index, tr_index, td_index, td_remove):
         """ Update 'rowspan' attributes in 'td' entries """
         # Look for '^' (vertical align top) or '=' (bottom) in the marker
-        marker = tbody[tr_index][td_index].text
-        v_align = 'middle'
-        if self.RE_valign_top.search(marker):
-            v_align = 'top'
-        if self.RE_valign_bottom.search(marker):
-            if v_align == 'top':
-                raise ValueError(
-                    'Cannot use both ^ (top) and = (bottom) codes in a row span '
-                    'marker\nCheck row %i, column %i in table %i in your '
-                    'document' % (tr_index+1, td_index+1, self.table_count)
-                )
-            v_align='bottom'
-
-        # Starting from the current row, go up the rows and delete columns
-        # until we hit a non-empty column (or the start of the table)
-        for row_num in reversed(range(tr_index+1)):
-            td = tbody[row_num][td_index]
-            if row_num == tr_index or self.RE_empty_cell.match(td.text):
-                td_remove.append( (tbody[row_num], td) )
-            else:
+        marker = column[tr_index].text
+        marker_chars = set(marker)
+        has_top = '^' in marker_chars
+        has_bottom = '=' in marker_chars
+        if has_top and has_bottom:
+            raise ValueError(
+                'Cannot use both ^ (top) and = (bottom) codes in a row span '
+                'marker\nCheck row %i, column %i in table %i in your '
+                'document' % (tr_index+1, td_index+1, t_index)
+            )
+        v_align = 'top' if has_top else 'bottom' if has_bottom else 'middle'
+
+        # Starting from the row above the marker, go up the rows until we hit
+        # a non-empty column (or the start of the table, or a row too short to
+        # have this column). That cell is kept and spans the rows below it.
+        row_num = tr_index
+        while row_num > 0:
+            td = column[row_num-1]
+            if td is None:          # Row too short to have this column
+                break
+            row_num -= 1
+            if not _is_empty_cell(td.text):
                 break
 
-        # Update the colspan and valign attributes on the row
-        td = tbody[row_num][td_index] if row_num >=0 else tbody[0][td_index]
-        td.set('rowspan', str(tr_index-row_num+1))
-
+        # Delete the columns from the row below the kept cell to the marker
+        for r in range(row_num+1, tr_index+1):
+            td_remove.append( (tr_list[r], column[r]) )
+
+        # Update the rowspan and valign attributes on the row. Middle is the
+        # default for table cells, so only top and bottom need a style.
+        td = column[row_num]
+        attrs = {'rowspan': str(tr_index-row_num+1)}
+        if v_align != 'middle':
+            style = 'vertical-align: %s;' % v_align
+            if 'style' in td.attrib:    # Keep any alignment from the tables extension
+                style = '%s; %s' % (td.attrib['style'].rstrip('; '), style)
+            attrs['style'] = style
+        td.attrib.update(attrs)
+
+
+    def _process_table(self, table, rows, t_index):
+        """ Add cell and row spans to one table, given its source rows """
+        # Bind the regex method used in the loops below to a local
+        row_span_marker = RE_row_span_marker.match
+
+        # Scan the original table text for adjacent columns and spanned rows
+        tbody = table.find('tbody')
+        td_remove = []  # List of td objects to be removed
+        tr_list = list(tbody)
+        columns = {}    # Cells of each column holding a marker, by column index
+        for tr_index, tr in enumerate(tr_list):
+            # Check for adjacent columns. Rows in the source are offset by
+            # two from the tbody rows (header row and delimiter row).
+            data_row_idx = tr_index + 2
+            if data_row_idx < len(rows):
+                row = rows[data_row_idx]
+                if _has_adjacent_bars(row):
+                    self._update_colspan_attrib(row, t_index, tr_index, tr, td_remove)
+            # Check for spanned rows
+            for td_index, td in enumerate(tr):
+                # A marker has at least two characters and starts and ends
+                # with '_'; check that before running the regex, since
+                # almost no cells are markers
+                text = td.text
+                if (text and len(text) > 1 and text[0] == '_' and text[-1] == '_'
+                        and row_span_marker(text)):
+                    column = columns.get(td_index)
+                    if column is None:
+                        column = columns[td_index] = [
+                            r[td_index] if td_index < len(r) else None for r in tr_list
+                        ]
+                    self._update_rowspan_attrib(tr_list, column, t_index, tr_index, td_index, td_remove)
+
+        # Remove unneeded td elements, rebuilding each affected row once
+        removed = {}    # id(tr) -> (tr, set of ids of td elements to remove)
+        for tr, td in td_remove:
+            removed.setdefault(id(tr), (tr, set()))[1].add(id(td))
+        for tr, td_ids in removed.values():
+            tr[:] = [td for td in tr if id(td) not in td_ids]
 
     def run(self, root):
-        # Process all the tables in the ElementTree
+        # Process all the tables in the ElementTree. Each table is handled
+        # on its own, with only its saved rows and its position in the list.
         t_index = 0
         for table in root.findall('.//table'):
-            # Retrieve the block saved by the BlockProcessor
-            rows = self.table_blocks[t_index].split('\n')
+            # Retrieve the block rows saved by the BlockProcessor
+            rows = self.table_blocks[t_index]
             t_index += 1
-
-            # Scan the original table text for adjacent columns and spanned rows
-            tbody = table.find('tbody')
-            td_remove = []  # List of td objects to be removed
-            tr_index = 0
-            for tr in tbody:
-                # Check for adjacent columns
-                if tr_index + 2 in rows and self.RE_adjacent_bars.search(rows[tr_index+2]):
-                    self._update_colspan_attrib(rows[tr_index+2], t_index, tr_index, tr, td_remove)
-                # Check for spanned rows
-                td_index = 0
-                for td in tr:
-                    if self.RE_row_span_marker.match(td.text):
-                        self._update_rowspan_attrib(tbody, tr_index, td_index, td_remove)
-                    td_index += 1
-                tr_index += 1
-
-            # Remove unneeded td elements
-            for tr, td in td_remove:
-                if td in tr:
-                    tr.remove(td)
+            if rows is not None:
+                self._process_table(table, rows, t_index)
 
 def makeExtension(*args, **kwargs):
     return CellRowSpanExtension(*args, **kwargs)